@@ -0,0 +1,162 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Compiled record serialization for demux ascii export
+
+Serializing a sample is pure byte assembly: a formatted header, the
+sequence, and for FASTQ the offset-shifted quality row. Doing that per
+record in Python costs several object allocations and interpreter
+dispatches each; here every record is written once into an exactly-sized
+bytes object through memcpy and snprintf. The module is optional;
+``qiita_files.demux`` falls back to a pure Python loop when it is not
+built.
+"""
+
+from cpython.bytes cimport PyBytes_AS_STRING, PyBytes_FromStringAndSize
+from libc.stdio cimport snprintf
+from libc.string cimport memcpy
+
+cimport numpy as cnp
+
+DEF _HEADER_MAX = 1024
+
+
+cdef inline int _render_header(char* header, bytes sample, Py_ssize_t idx,
+                               bytes bc_o, bytes bc_c, long long err,
+                               char marker):
+    """Render one header line into `header`; -1 if it does not fit"""
+    cdef int hlen = snprintf(header, _HEADER_MAX,
+                             "%c%s_%zd orig_bc=%s new_bc=%s bc_diffs=%lld\n",
+                             marker, <const char*>sample, idx,
+                             <const char*>bc_o, <const char*>bc_c, err)
+    if hlen < 0 or hlen >= _HEADER_MAX:
+        return -1
+    return hlen
+
+
+def format_fastq_records(bytes sample, list seqs, cnp.uint8_t[:, ::1] quals,
+                         list bc_ori, list bc_cor, cnp.int64_t[::1] bc_err,
+                         int phred_offset=33):
+    """Serialize one sample to a list of formatted FASTQ records
+
+    Parameters
+    ----------
+    sample : bytes
+        The sample name
+    seqs : list of bytes
+        The sequences
+    quals : np.array of uint8, shape (n, max_length)
+        The quality scores, padded to the file-wide max length
+    bc_ori, bc_cor : list of bytes
+        The original and corrected barcodes
+    bc_err : np.array of int64
+        The barcode errors
+    phred_offset : int, optional
+        The offset to shift quality scores by when encoding
+
+    Returns
+    -------
+    list of bytes
+        One formatted FASTQ record per sequence
+    """
+    cdef Py_ssize_t n = len(seqs)
+    cdef list out = [None] * n
+    cdef char header[_HEADER_MAX]
+    cdef Py_ssize_t i, j, m, hlen
+    cdef bytes seq, bc_o, bc_c, rec, py_header
+    cdef char* buf
+
+    for i in range(n):
+        seq = seqs[i]
+        bc_o = bc_ori[i]
+        bc_c = bc_cor[i]
+        m = len(seq)
+
+        # header + seq + "\n+\n" + qual + "\n"
+        hlen = _render_header(header, sample, i, bc_o, bc_c,
+                              <long long>bc_err[i], b'@')
+        if hlen < 0:
+            # pathological header length; let Python build it and copy
+            # it straight into the record, never through the fixed array
+            py_header = b"@%s_%d orig_bc=%s new_bc=%s bc_diffs=%d\n" % (
+                sample, i, bc_o, bc_c, bc_err[i])
+            hlen = len(py_header)
+            rec = PyBytes_FromStringAndSize(NULL, hlen + 2 * m + 4)
+            buf = PyBytes_AS_STRING(rec)
+            memcpy(buf, <const char*>py_header, hlen)
+        else:
+            rec = PyBytes_FromStringAndSize(NULL, hlen + 2 * m + 4)
+            buf = PyBytes_AS_STRING(rec)
+            memcpy(buf, header, hlen)
+
+        memcpy(buf + hlen, <const char*>seq, m)
+        buf[hlen + m] = b'\n'
+        buf[hlen + m + 1] = b'+'
+        buf[hlen + m + 2] = b'\n'
+        for j in range(m):
+            buf[hlen + m + 3 + j] = <char>(quals[i, j] + phred_offset)
+        buf[hlen + 2 * m + 3] = b'\n'
+
+        out[i] = rec
+
+    return out
+
+
+def format_fasta_records(bytes sample, list seqs, list bc_ori, list bc_cor,
+                         cnp.int64_t[::1] bc_err):
+    """Serialize one sample to a list of formatted FASTA records
+
+    Parameters
+    ----------
+    sample : bytes
+        The sample name
+    seqs : list of bytes
+        The sequences
+    bc_ori, bc_cor : list of bytes
+        The original and corrected barcodes
+    bc_err : np.array of int64
+        The barcode errors
+
+    Returns
+    -------
+    list of bytes
+        One formatted FASTA record per sequence
+    """
+    cdef Py_ssize_t n = len(seqs)
+    cdef list out = [None] * n
+    cdef char header[_HEADER_MAX]
+    cdef Py_ssize_t i, m, hlen
+    cdef bytes seq, bc_o, bc_c, rec, py_header
+    cdef char* buf
+
+    for i in range(n):
+        seq = seqs[i]
+        bc_o = bc_ori[i]
+        bc_c = bc_cor[i]
+        m = len(seq)
+
+        hlen = _render_header(header, sample, i, bc_o, bc_c,
+                              <long long>bc_err[i], b'>')
+        if hlen < 0:
+            py_header = b">%s_%d orig_bc=%s new_bc=%s bc_diffs=%d\n" % (
+                sample, i, bc_o, bc_c, bc_err[i])
+            hlen = len(py_header)
+            rec = PyBytes_FromStringAndSize(NULL, hlen + m + 1)
+            buf = PyBytes_AS_STRING(rec)
+            memcpy(buf, <const char*>py_header, hlen)
+        else:
+            rec = PyBytes_FromStringAndSize(NULL, hlen + m + 1)
+            buf = PyBytes_AS_STRING(rec)
+            memcpy(buf, header, hlen)
+
+        memcpy(buf + hlen, <const char*>seq, m)
+        buf[hlen + m] = b'\n'
+
+        out[i] = rec
+
+    return out
@@ -10,13 +10,16 @@ Attributes off of ./ for the full file:
     median    : float, the median sequence length
     hist      : np.array of int, 10 bin histogram of sequence lengths
     hist_edge : np.array of int, left edge of each bin
+    has-qual  : bool, whether the input carried quality scores
 
 Each sample has its own group with the following structure:
 
     ./<sample_name>/sequence          : (N,) of str where N is the number of \
 sequences in the sample
     ./<sample_name>/qual              : (N, M) of int where N is the number \
-of sequences in the sample, and M is the max sequence length (file-wide)
+of sequences in the sample, and M is the max sequence length (file-wide). \
+Only present when the file-level 'has-qual' attribute is true; files built \
+from FASTA input do not carry it
     ./<sample_name>/barcode/corrected : (N,) of str where N is the number of \
 sequences in the sample
     ./<sample_name>/barcode/original  : (N,) of str where N is the number of \
@@ -46,7 +49,9 @@ sample group:
 # -----------------------------------------------------------------------------
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+from gzip import open as gzip_open
 from itertools import repeat
 from collections import defaultdict, namedtuple
 from re import search
@@ -59,6 +64,12 @@ from qiita_files.format.fasta import format_fasta_record
 from qiita_files.format.fastq import format_fastq_record
 from qiita_files.util import open_file
 
+try:
+    from qiita_files import _demux_cy
+except ImportError:
+    # optional compiled serializer; the Python loop below is equivalent
+    _demux_cy = None
+
 
 # track some basic stats about the samples
 stat = namedtuple('stat', 'n max min mean median std hist hist_edge')
@@ -72,6 +83,14 @@ dset_paths = {'sequence': 'sequence',
 
 dset_paths_bytes = {k: v.encode('ascii') for k, v in dset_paths.items()}
 
+# aggregate cap, in bytes, on the per-sample columns to_hdf5 stages in
+# memory; samples beyond the budget stream through the incremental
+# buffers instead so peak memory does not scale with the input file
+_STAGE_BUDGET = 512 * 1024 * 1024
+
+# records accumulated per spilled sample before a write_many deposit
+_SPILL_BATCH = 2048
+
 
 class _buffer(object):
     """Buffer baseclass that sits on top of an HDF5 dataset
@@ -120,9 +139,37 @@ class _buffer(object):
         if self.is_full():
             self.flush()
 
+    def write_many(self, data):
+        """Deposit many elements at once, flushing as the buffer fills
+
+        Parameters
+        ----------
+        data : sequence or np.array
+            One entry per element, where each entry is what `write` accepts.
+
+        Notes
+        -----
+        Depositing a batch amortizes the per-call overhead of `write` and
+        lets the underlying copy happen as a slab where the buffer layout
+        allows it.
+        """
+        k = len(data)
+        pos = 0
+        while pos < k:
+            take = min(self._max_fill - self._n, k - pos)
+            self._write_many(data[pos:pos + take])
+            self._n += take
+            pos += take
+
+            if self.is_full():
+                self.flush()
+
     def _write(self, data):
         raise NotImplementedError
 
+    def _write_many(self, data):
+        raise NotImplementedError
+
     def _alloc(self):
         raise NotImplementedError
 
@@ -159,6 +206,10 @@ class buffer1d(_buffer):
     def _write(self, data):
         self._buf[self._n] = data
 
+    def _write_many(self, data):
+        # a single vectorized assignment into the free region
+        self._buf[self._n:self._n + len(data)] = data
+
     def _alloc(self):
         self._buf = np.zeros(self._max_fill, self.dset.dtype)
 
@@ -176,11 +227,84 @@ class buffer2d(_buffer):
     def _write(self, data):
         self._buf[self._n, :data.size] = data
 
+    def write_into(self, src, length):
+        """Deposit the leading elements of a reusable scratch row
+
+        Parameters
+        ----------
+        src : np.array
+            The scratch array holding the row; only the first `length`
+            elements are read.
+        length : unsigned int
+            The number of valid elements in `src`.
+
+        Notes
+        -----
+        Equivalent to ``write(src[:length])``, but callers can fill one
+        preallocated scratch array per record loop instead of allocating
+        a fresh row for every write; the trailing elements of the buffer
+        row stay zero.
+        """
+        self._buf[self._n, :length] = src[:length]
+        self._n += 1
+
+        if self.is_full():
+            self.flush()
+
+    def _write_many(self, data):
+        if isinstance(data, np.ndarray) and data.ndim == 2:
+            # uniform row lengths arrive as a 2D slab
+            self._buf[self._n:self._n + data.shape[0], :data.shape[1]] = data
+        else:
+            # ragged rows (e.g. variable length quals) go row by row, but
+            # fullness is still only checked once per batch
+            n = self._n
+            buf = self._buf
+            for i, row in enumerate(data):
+                buf[n + i, :len(row)] = row
+
     def _alloc(self):
         shape = (self._max_fill, self.dset.shape[1])
         self._buf = np.zeros(shape, dtype=self.dset.dtype)
 
 
+def barcode_mismatches(original, corrected):
+    """Count mismatching positions between two barcode columns
+
+    Parameters
+    ----------
+    original, corrected : np.ndarray of S dtype
+        Fixed width byte columns, e.g. the barcode/original and
+        barcode/corrected datasets of a sample.
+
+    Returns
+    -------
+    np.array of int32
+        The number of differing bytes per row.
+
+    Notes
+    -----
+    The columns are viewed as (n, k) uint8 matrices and compared with a
+    single vectorized not-equal and row sum, so the cost is one SIMD
+    pass over the data rather than a Python loop over records. The NUL
+    padding of short barcodes compares equal and does not contribute.
+    """
+    original = np.ascontiguousarray(original)
+    corrected = np.ascontiguousarray(corrected)
+
+    if original.dtype != corrected.dtype:
+        width = max(original.dtype.itemsize, corrected.dtype.itemsize)
+        dtype = np.dtype('S%d' % width)
+        original = original.astype(dtype)
+        corrected = corrected.astype(dtype)
+
+    width = original.dtype.itemsize
+    a = original.view(np.uint8).reshape(-1, width)
+    b = corrected.view(np.uint8).reshape(-1, width)
+
+    return (a != b).sum(axis=1, dtype=np.int32)
+
+
 def _has_qual(fp):
     """Check if it looks like we have qual"""
     iter_ = load(fp)
@@ -202,6 +326,34 @@ def _per_sample_lengths(fp):
         {sample_id: [sequence_length]}
     """
     lengths = defaultdict(list)
+
+    # this pass needs only the sample id out of each header and the
+    # summed length of the sequence lines, so FASTA is scanned as raw
+    # bytes: no record assembly, no sequence decode, and one dict
+    # operation per record through the defaultdict
+    if fp.endswith(('.fna', '.fasta', '.fna.gz', '.fasta.gz')):
+        opener = gzip_open if fp.endswith('.gz') else open
+        current = None
+        current_len = 0
+
+        with opener(fp, 'rb') as fh:
+            for line in fh:
+                head = line[:1]
+                if head == b'>':
+                    if current is not None:
+                        lengths[current].append(current_len)
+                    fields = line[1:].split(None, 1)
+                    sample_id = fields[0].rsplit(b'_', 1)[0] if fields else b''
+                    current = sample_id.decode('utf-8')
+                    current_len = 0
+                elif head != b'#':
+                    current_len += len(line.strip())
+
+        if current is not None:
+            lengths[current].append(current_len)
+
+        return lengths
+
     for record in load(fp):
         sample_id = record['SequenceID'].split(' ')[0].rsplit('_', 1)[0]
         lengths[sample_id].append(len(record['Sequence']))
@@ -209,6 +361,42 @@ def _per_sample_lengths(fp):
     return lengths
 
 
+# scalar stats live in one structured array rather than thousands of
+# small Python objects when a file carries many samples
+STAT_DTYPE = np.dtype([('n', 'i8'), ('max', 'i8'), ('min', 'i8'),
+                       ('mean', 'f8'), ('median', 'f8'), ('std', 'f8')])
+
+
+def _fill_stats_from_counts(counts, rec, hist, hist_edge):
+    """Derive one stats row from a vector of counts per integer length
+
+    Every summary in a `stat` is expressible over (value, count) pairs:
+    the moments as weighted sums, the median through the cumulative
+    counts, and the 10 bin histogram over the distinct values with the
+    counts as weights. This touches one entry per distinct length rather
+    than one per sequence, and writes straight into preallocated rows.
+    """
+    values = np.nonzero(counts)[0]
+    weights = counts[values]
+    n = int(weights.sum())
+
+    rec['n'] = n
+    rec['max'] = values[-1]
+    rec['min'] = values[0]
+    rec['mean'] = mean = np.dot(values, weights) / n
+    rec['std'] = np.sqrt(np.dot((values - mean) ** 2, weights) / n)
+
+    cumulative = np.cumsum(weights)
+    if n % 2:
+        rec['median'] = values[np.searchsorted(cumulative, n // 2 + 1)]
+    else:
+        lower = values[np.searchsorted(cumulative, n // 2)]
+        upper = values[np.searchsorted(cumulative, n // 2 + 1)]
+        rec['median'] = (lower + upper) / 2
+
+    hist[:], hist_edge[:] = np.histogram(values, weights=weights)
+
+
 def _summarize_lengths(lengths):
     """Summarize lengths per sample
 
@@ -223,29 +411,50 @@ def _summarize_lengths(lengths):
         {sample_id: sample_stat}
     stat
         The full file stats
+
+    Notes
+    -----
+    Lengths are small non-negative integers, so each sample is collapsed
+    to a count per distinct length with a single bincount pass; the full
+    file stats are then derived by summing the per-sample count vectors,
+    without ever concatenating the raw lengths. Internally the summaries
+    are accumulated columnar -- one structured array of scalars and one
+    matrix each for the histograms and their edges -- and the returned
+    `stat` tuples hold row views of those, so the per-sample object churn
+    stays flat as the sample count grows.
     """
-    sample_stats = {}
-    all_lengths = np.zeros(sum([len(v) for v in lengths.values()]), int)
-    pos = 0
+    sids = list(lengths)
+    num_samples = len(sids)
+
+    # one extra row for the full file summary
+    recs = np.empty(num_samples + 1, STAT_DTYPE)
+    hists = np.empty((num_samples + 1, 10), np.int64)
+    edges = np.empty((num_samples + 1, 11), np.float64)
+
+    total_counts = np.zeros(0, int)
+    for i, sid in enumerate(sids):
+        counts = np.bincount(lengths[sid])
+        _fill_stats_from_counts(counts, recs[i], hists[i], edges[i])
+
+        if counts.size > total_counts.size:
+            counts = counts.copy()
+            counts[:total_counts.size] += total_counts
+            total_counts = counts
+        else:
+            total_counts[:counts.size] += counts
 
-    for sid, lens in lengths.items():
-        lens = np.array(lens)
-        hist, edge = np.histogram(lens)
-        sample_stats[sid] = stat(n=lens.size, max=lens.max(), std=lens.std(),
-                                 min=lens.min(), mean=lens.mean(),
-                                 median=np.median(lens), hist=hist,
-                                 hist_edge=edge)
+    _fill_stats_from_counts(total_counts, recs[num_samples],
+                            hists[num_samples], edges[num_samples])
 
-        all_lengths[pos:pos+lens.size] = lens
-        pos += lens.size
+    def _stat_view(i):
+        rec = recs[i]
+        return stat(n=int(rec['n']), max=int(rec['max']), min=int(rec['min']),
+                    mean=float(rec['mean']), median=float(rec['median']),
+                    std=float(rec['std']), hist=hists[i], hist_edge=edges[i])
 
-    hist, edge = np.histogram(all_lengths)
-    full_stats = stat(n=all_lengths.size, max=all_lengths.max(),
-                      min=all_lengths.min(), std=all_lengths.std(),
-                      mean=all_lengths.mean(), median=np.median(all_lengths),
-                      hist=hist, hist_edge=edge)
+    sample_stats = {sid: _stat_view(i) for i, sid in enumerate(sids)}
 
-    return sample_stats, full_stats
+    return sample_stats, _stat_view(num_samples)
 
 
 def _set_attr_stats(h5grp, stats):
@@ -268,7 +477,8 @@ def _set_attr_stats(h5grp, stats):
     h5grp.attrs['hist_edge'] = stats.hist_edge
 
 
-def _construct_datasets(sample_stats, h5file, max_barcode_length=12):
+def _construct_datasets(sample_stats, h5file, max_barcode_length=12,
+                        has_qual=True, with_buffers=True):
     """Construct the datasets within the h5file
 
     Parameters
@@ -277,26 +487,43 @@ def _construct_datasets(sample_stats, h5file, max_barcode_length=12):
         {sample_id: stat}
     h5file : h5py.File
         The file to store the demux data
+    has_qual : bool, optional
+        Whether the input carries quality scores. When ``False`` the qual
+        datasets are not created at all: for FASTA input they would only
+        ever hold zeros, and skipping them drops both the write-time
+        allocation and the read bandwidth later.
+    with_buffers : bool, optional
+        When ``False`` the raw datasets are returned instead of wrapping
+        each in a `_buffer`, skipping the buffer allocations for callers
+        that write through another mechanism.
 
     Returns
     -------
     dict
         {str : _buffer} where str is the dataset path and the `_buffer` is
-        either `buffer1d` or `buffer2d`.
+        either `buffer1d` or `buffer2d`, or {str : h5py.Dataset} when
+        ``with_buffers`` is ``False``.
     """
     def create_dataset(path, dtype, rows, cols):
+        # chunks are sized to the data rather than h5py's guess: whole
+        # rows for the 2D qual scores so a read of k sequences touches k
+        # rows of one chunk column, and large slabs for the 1D columns.
+        # LZF trades a little ratio for much cheaper (de)compression,
+        # which suits the low entropy of quals and nucleotide strings.
         if cols == 1:
             shape = (rows,)
+            chunks = (min(rows, 8192),)
             buftype = buffer1d
         else:
             shape = (rows, cols)
+            chunks = (min(rows, 4096), cols)
             buftype = buffer2d
 
-        kwargs = {'chunks': True, 'compression': True, 'compression_opts': 1}
+        kwargs = {'chunks': chunks, 'compression': 'lzf'}
         dset = h5file.create_dataset(path, dtype=dtype, shape=shape, **kwargs)
-        return buftype(dset)
+        return buftype(dset) if with_buffers else dset
 
-    buffers = {}
+    out = {}
 
     for sid, stats in sample_stats.items():
         # determine group
@@ -310,20 +537,21 @@ def _construct_datasets(sample_stats, h5file, max_barcode_length=12):
 
         # construct datasets
         path = pjoin(dset_paths['sequence'])
-        buffers[path] = create_dataset(path, seq_dtype, rows, 1)
+        out[path] = create_dataset(path, seq_dtype, rows, 1)
         path = pjoin(dset_paths['barcode_original'])
-        buffers[path] = create_dataset(path, bc_dtype, rows, 1)
+        out[path] = create_dataset(path, bc_dtype, rows, 1)
         path = pjoin(dset_paths['barcode_corrected'])
-        buffers[path] = create_dataset(path, bc_dtype, rows, 1)
+        out[path] = create_dataset(path, bc_dtype, rows, 1)
         path = pjoin(dset_paths['barcode_error'])
-        buffers[path] = create_dataset(path, int, rows, 1)
-        path = pjoin(dset_paths['qual'])
-        buffers[path] = create_dataset(path, np.uint8, rows, cols)
+        out[path] = create_dataset(path, int, rows, 1)
+        if has_qual:
+            path = pjoin(dset_paths['qual'])
+            out[path] = create_dataset(path, np.uint8, rows, cols)
 
         # set stats
         _set_attr_stats(h5file[sid], stats)
 
-    return buffers
+    return out
 
 
 def to_hdf5(fp, h5file, max_barcode_length=12):
@@ -353,52 +581,210 @@ def to_hdf5(fp, h5file, max_barcode_length=12):
     """
     # walk over the file and collect summary stats
     sample_stats, full_stats = _summarize_lengths(_per_sample_lengths(fp))
+    has_qual = _has_qual(fp)
 
     # construct the datasets, storing per sample stats and full file stats
-    buffers = _construct_datasets(sample_stats, h5file)
+    dsets = _construct_datasets(sample_stats, h5file, has_qual=has_qual,
+                                with_buffers=False)
     _set_attr_stats(h5file, full_stats)
-    h5file.attrs['has-qual'] = _has_qual(fp)
+    h5file.attrs['has-qual'] = has_qual
+
+    sample_dsets = {}
+    footprints = {}
+    for sid in sample_stats:
+        pjoin = partial(os.path.join, sid)
+        sd = {key: dsets[pjoin(rel_path)]
+              for key, rel_path in dset_paths.items()
+              if key != 'qual' or has_qual}
+        sample_dsets[sid] = sd
+        footprints[sid] = sum(d.dtype.itemsize * d.size for d in sd.values())
+
+    # the number of sequences per sample is known from the stats pass, so
+    # whole per-sample columns are assembled in memory and every dataset
+    # is stored with a single hdf5 assignment; the per-record work reduces
+    # to filling numpy arrays at a cursor. The columns are capped in
+    # aggregate by _STAGE_BUDGET -- smallest samples first, so as many as
+    # possible fit -- and samples beyond the budget spill through the
+    # incremental buffers in _SPILL_BATCH record batches instead, keeping
+    # peak memory independent of the input file size
+    columns = {}
+    spills = {}
+    cursors = {}
+    totals = {}
+    staged = 0
+    for sid in sorted(sample_stats, key=footprints.get):
+        if staged + footprints[sid] <= _STAGE_BUDGET:
+            staged += footprints[sid]
+            columns[sid] = {key: np.zeros(d.shape, d.dtype)
+                            for key, d in sample_dsets[sid].items()}
+        else:
+            bufs = {key: buffer2d(d) if len(d.shape) == 2 else buffer1d(d)
+                    for key, d in sample_dsets[sid].items()}
+            spills[sid] = (bufs, {key: [] for key in bufs})
+        cursors[sid] = 0
+        totals[sid] = int(sample_stats[sid].n)
 
-    for rec in load(fp):
-        result = search((r'^(?P<sample>.+?)_\d+? .*orig_bc=(?P<orig_bc>.+?) '
-                         r'new_bc=(?P<corr_bc>.+?) '
-                         r'bc_diffs=(?P<bc_diffs>\d+)'),
-                        rec['SequenceID'])
+    def _store_sample(sid, cols):
+        pjoin = partial(os.path.join, sid)
+        for key, arr in cols.items():
+            h5file[pjoin(dset_paths[key])][...] = arr
+
+    # a sample's columns are complete as soon as its last record has
+    # been staged, so they are handed to a single writer thread there
+    # and then; h5py releases the GIL inside the write, letting the
+    # compression and storage of finished samples overlap the parsing
+    # of the remaining records
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        stores = []
+
+        for rec in load(fp):
+            result = search((r'^(?P<sample>.+?)_\d+? '
+                             r'.*orig_bc=(?P<orig_bc>.+?) '
+                             r'new_bc=(?P<corr_bc>.+?) '
+                             r'bc_diffs=(?P<bc_diffs>\d+)'),
+                            rec['SequenceID'])
+
+            if result is None:
+                raise ValueError("%s doesn't appear to be split libraries "
+                                 "output!" % fp)
+
+            sample = result.group('sample')
+            qual = rec['Qual']
+
+            cols = columns.get(sample)
+            if cols is None:
+                # spilled sample: batch records and deposit them through
+                # the buffers on the writer thread
+                bufs, pending = spills[sample]
+                pending['sequence'].append(rec['Sequence'])
+                pending['barcode_original'].append(result.group('orig_bc'))
+                pending['barcode_corrected'].append(result.group('corr_bc'))
+                pending['barcode_error'].append(int(result.group('bc_diffs')))
+                if qual is not None:
+                    pending['qual'].append(qual)
+
+                if len(pending['sequence']) >= _SPILL_BATCH:
+                    for key, values in pending.items():
+                        stores.append(writer.submit(bufs[key].write_many,
+                                                    values))
+                    spills[sample] = (bufs, {key: [] for key in bufs})
+                continue
 
-        if result is None:
-            raise ValueError("%s doesn't appear to be split libraries "
-                             "output!" % fp)
+            idx = cursors[sample]
+            cursors[sample] = idx + 1
 
-        sample = result.group('sample')
-        bc_diffs = result.group('bc_diffs')
-        corr_bc = result.group('corr_bc')
-        orig_bc = result.group('orig_bc')
+            cols['sequence'][idx] = rec['Sequence']
+            cols['barcode_original'][idx] = result.group('orig_bc')
+            cols['barcode_corrected'][idx] = result.group('corr_bc')
+            cols['barcode_error'][idx] = result.group('bc_diffs')
 
-        sequence = rec['Sequence']
-        qual = rec['Qual']
+            if qual is not None:
+                cols['qual'][idx, :qual.size] = qual
 
-        pjoin = partial(os.path.join, sample)
-        buffers[pjoin(dset_paths['sequence'])].write(sequence)
-        buffers[pjoin(dset_paths['barcode_original'])].write(orig_bc)
-        buffers[pjoin(dset_paths['barcode_corrected'])].write(corr_bc)
-        buffers[pjoin(dset_paths['barcode_error'])].write(bc_diffs)
+            if idx + 1 == totals[sample]:
+                stores.append(writer.submit(_store_sample, sample,
+                                            columns.pop(sample)))
 
-        if qual is not None:
-            buffers[pjoin(dset_paths['qual'])].write(qual)
+        # anything left over (only possible with fewer records than the
+        # stats pass counted) is stored as-is
+        for sid, cols in columns.items():
+            stores.append(writer.submit(_store_sample, sid, cols))
 
+        # push the remaining spill batches and flush the buffers; the
+        # single worker runs these after every deposit already queued
+        def _drain(bufs, pending):
+            for key, values in pending.items():
+                if values:
+                    bufs[key].write_many(values)
+            for buf in bufs.values():
+                if buf._n:
+                    buf.flush()
 
-def _to_ascii(demux, samples, formatter):
-    """Aux function to change from hdf5 to ascii"""
-    id_fmt = (b"%(sample)s_%(idx)d orig_bc=%(bc_ori)s new_bc=%(bc_cor)s "
-              b"bc_diffs=%(bc_diff)d")
+        for bufs, pending in spills.values():
+            stores.append(writer.submit(_drain, bufs, pending))
+
+        for store in stores:
+            store.result()
 
-    for samp, idx, seq, qual, bc_ori, bc_cor, bc_err in fetch(demux, samples):
-        seq_id = id_fmt % {b'sample': samp, b'idx': idx, b'bc_ori': bc_ori,
-                           b'bc_cor': bc_cor, b'bc_diff': bc_err}
-        if isinstance(qual, np.ndarray):
-            qual = qual.astype(np.uint8)
 
-        yield formatter(seq_id, seq, qual)
+def _load_sample_arrays(demux, samp, has_qual):
+    """Read all columns of one sample, one h5py call per dataset
+
+    Each dataset is read in full with ``read_direct`` into a
+    preallocated contiguous array, which bypasses the slice-selection
+    translation and the intermediate allocation that ``dset[:]`` pays
+    per call.
+    """
+    pjoin = partial(os.path.join, samp)
+
+    def read_all(key, dtype=None):
+        dset = demux[pjoin(dset_paths_bytes[key])]
+        arr = np.empty(dset.shape, dtype if dtype is not None else dset.dtype)
+        if arr.size:
+            dset.read_direct(arr)
+        return arr
+
+    seqs = read_all('sequence')
+    bc_ori = read_all('barcode_original')
+    bc_cor = read_all('barcode_corrected')
+    bc_err = read_all('barcode_error')
+    quals = read_all('qual', np.uint8) if has_qual else None
+
+    return seqs, bc_ori, bc_cor, bc_err, quals
+
+
+def _to_ascii(demux, samples, formatter):
+    """Aux function to change from hdf5 to ascii
+
+    Each sample is pulled as whole-column reads, one h5py call per
+    dataset, and the records are then emitted from a tight loop over
+    numpy arrays; no per-record dataset access or dict-based formatting
+    remains on the hot path. While one sample is being formatted, the
+    next sample's columns are prefetched from a background thread --
+    h5py drops the GIL during reads, so decompression and formatting
+    overlap instead of alternating.
+    """
+    id_fmt = b"%s_%d orig_bc=%s new_bc=%s bc_diffs=%d"
+    has_qual = demux.attrs['has-qual']
+
+    present = [samp for samp in samples if samp in demux]
+    if not present:
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        pending = prefetcher.submit(_load_sample_arrays, demux, present[0],
+                                    has_qual)
+
+        for pos, samp in enumerate(present):
+            seqs, bc_ori, bc_cor, bc_err, quals = pending.result()
+            if pos + 1 < len(present):
+                pending = prefetcher.submit(_load_sample_arrays, demux,
+                                            present[pos + 1], has_qual)
+
+            # the compiled serializer covers the two stock formatters;
+            # custom formatters and str sample names take the Python loop
+            if _demux_cy is not None and isinstance(samp, bytes):
+                errs = np.ascontiguousarray(bc_err, dtype=np.int64)
+                if formatter is format_fastq_record and has_qual:
+                    yield from _demux_cy.format_fastq_records(
+                        samp, seqs.tolist(), quals, bc_ori.tolist(),
+                        bc_cor.tolist(), errs)
+                    continue
+                elif formatter is format_fasta_record:
+                    yield from _demux_cy.format_fasta_records(
+                        samp, seqs.tolist(), bc_ori.tolist(), bc_cor.tolist(),
+                        errs)
+                    continue
+
+            for idx in range(len(seqs)):
+                seq = seqs[idx]
+                seq_id = id_fmt % (samp, idx, bc_ori[idx], bc_cor[idx],
+                                   bc_err[idx])
+                # qual rows are padded to the file-wide max; trim to the
+                # actual sequence length
+                qual = quals[idx, :len(seq)] if has_qual else []
+
+                yield formatter(seq_id, seq, qual)
 
 
 def to_ascii(demux, samples=None):
@@ -458,6 +844,86 @@ def to_per_sample_ascii(demux, samples=None):
         yield samp, to_ascii(demux, samples=[samp])
 
 
+def _write_coalesced(out, records, buffer_size=1048576):
+    """Write formatted records through a coalescing buffer
+
+    One record is one small write, and a sample easily holds millions of
+    them; gathering about `buffer_size` bytes before each `write` call
+    turns that into one syscall per megabyte, leaving the interpreter
+    formatting records while the kernel writes back the previous burst.
+    """
+    pending = []
+    pending_bytes = 0
+
+    for rec in records:
+        pending.append(rec)
+        pending_bytes += len(rec)
+
+        if pending_bytes >= buffer_size:
+            out.write(b''.join(pending))
+            pending = []
+            pending_bytes = 0
+
+    if pending:
+        out.write(b''.join(pending))
+
+
+# generous bound on the formatted header size beyond the sample name:
+# record index, two barcodes, the bc_diffs field and the literals
+_HEADER_OVERHEAD = 80
+
+# records are staged in one preallocated buffer before writing; outputs
+# larger than this flush the same buffer multiple times rather than
+# holding the whole file in memory
+_PREALLOC_CAP = 128 * 1024 * 1024
+
+
+def _estimate_ascii_size(demux, samples, out_format):
+    """Upper-bound the formatted output size from the stored stats"""
+    total = 0
+    for samp in samples:
+        if samp not in demux:
+            continue
+        attrs = demux[samp].attrs
+        n, maxlen = int(attrs['n']), int(attrs['max'])
+        if out_format == 'fastq':
+            # seq + qual lines plus '+\n' and two newlines
+            per_record = 2 * maxlen + 4
+        else:
+            per_record = maxlen + 1
+        total += n * (len(samp) + _HEADER_OVERHEAD + per_record)
+
+    return total
+
+
+def _write_prealloc(out, records, capacity):
+    """Write formatted records through one preallocated buffer
+
+    Unlike `_write_coalesced` this never builds intermediate joined
+    bytes: records are copied straight into a single buffer sized from
+    the demux stats, which for typical outputs means one allocation and
+    one write call for the whole file.
+    """
+    buf = bytearray(capacity)
+    view = memoryview(buf)
+    offset = 0
+
+    for rec in records:
+        k = len(rec)
+        if offset + k > capacity:
+            out.write(view[:offset])
+            offset = 0
+            if k > capacity:
+                # degenerate record larger than the whole buffer
+                out.write(rec)
+                continue
+        view[offset:offset + k] = rec
+        offset += k
+
+    if offset:
+        out.write(view[:offset])
+
+
 def to_ascii_file(demux_fp, output_fp, samples=None, out_format='fastq'):
     """Writes the sequences on FASTQ or FASTA format
 
@@ -489,17 +955,24 @@ def to_ascii_file(demux_fp, output_fp, samples=None, out_format='fastq'):
     with open_file(demux_fp, 'r') as demux:
         if samples is None:
             samples = list(demux.keys())
+        # the stored stats bound the output size, so the staging buffer
+        # can be allocated once up front instead of grown write by write
+        capacity = min(_estimate_ascii_size(demux, samples, out_format),
+                       _PREALLOC_CAP)
+
         samples = [s.encode() for s in samples]
         with open(output_fp, 'wb') as out:
-            for rec in _to_ascii(demux, samples, formatter):
-                out.write(rec)
+            if capacity:
+                _write_prealloc(out, _to_ascii(demux, samples, formatter),
+                                capacity)
+            else:
+                _write_coalesced(out, _to_ascii(demux, samples, formatter))
 
 
 def _to_file(demux_fp, sample, fp, formatter):
     with open_file(demux_fp, 'r') as demux:
         with open(fp, 'wb') as out:
-            for rec in _to_ascii(demux, [sample], formatter):
-                out.write(rec)
+            _write_coalesced(out, _to_ascii(demux, [sample], formatter))
 
 
 def to_per_sample_files(demux_fp, samples=None, out_dir='./', n_jobs=1,
@@ -530,12 +1003,19 @@ def to_per_sample_files(demux_fp, samples=None, out_dir='./', n_jobs=1,
     else:
         raise ValueError("'out_format' should be either 'fastq' or 'fasta', "
                          "found: %s" % out_format)
-    if samples is None:
-        with open_file(demux_fp, 'r') as demux:
+    with open_file(demux_fp, 'r') as demux:
+        if samples is None:
             # We need to call list because demux.keys() is a KeysView object
             # from the file, and the file will be closed once we exit the
             # context manager
             samples = list(demux.keys())
+        counts = {s: demux[s].attrs['n'] for s in samples if s in demux}
+
+    # per-sample work is embarrassingly parallel: the workers re-open the
+    # demux read-only and write disjoint outputs. Largest samples are
+    # dispatched first so a big straggler does not serialize the tail of
+    # the run.
+    samples = sorted(samples, key=lambda s: counts.get(s, 0), reverse=True)
 
     if out_dir is None:
         out_dir = './'
@@ -544,7 +1024,7 @@ def to_per_sample_files(demux_fp, samples=None, out_dir='./', n_jobs=1,
     samples_and_paths = [(s.encode(), path_builder(file_name_fmt % s))
                          for s in samples]
 
-    with joblib.Parallel(n_jobs=n_jobs) as par:
+    with joblib.Parallel(n_jobs=n_jobs, backend='loky') as par:
         par(joblib.delayed(_to_file)(demux_fp, sample, s_fp, formatter)
             for sample, s_fp in samples_and_paths)
 
@@ -24,4 +24,5 @@ def format_fasta_record(seqid, seq, qual):
     str
         A formatted sequence record
     """
-    return b'\n'.join([b'>' + seqid, seq, b''])
+    # a single C-level format call; no list and join machinery per record
+    return b'>%s\n%s\n' % (seqid, seq)
@@ -0,0 +1,158 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+# ----------------------------------------------------------------------------
+# Copyright (c) 2013--, scikit-bio development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""C-level record loop for FASTQ parsing.
+
+This module mirrors the semantics of ``qiita_files.parse.fastq.parse_fastq``
+but reads the file in large chunks and scans for record boundaries with
+``memchr`` rather than iterating Python-level line objects. ``parse_fastq``
+transparently dispatches here when the extension has been built; otherwise
+the pure Python implementation is used.
+"""
+
+from libc.string cimport memchr
+
+cimport numpy as cnp
+import numpy as np
+
+cnp.import_array()
+
+# read size for each pass against the underlying file object
+DEF _CHUNK_SIZE = 1048576
+
+
+cdef inline bint _is_space(unsigned char c):
+    return c == b' ' or c == b'\t' or c == b'\n' or c == b'\r' or \
+        c == b'\v' or c == b'\f'
+
+
+cdef bytes _strip(const unsigned char* p, Py_ssize_t start, Py_ssize_t end):
+    """Equivalent of bytes.strip() over p[start:end]"""
+    while start < end and _is_space(p[start]):
+        start += 1
+    while end > start and _is_space(p[end - 1]):
+        end -= 1
+    return (<const char*>p)[start:end]
+
+
+def parse_fastq_cy(data, bint strict=False, bint enforce_qual_range=True,
+                   int phred_offset=33):
+    r"""yields label, seq, and qual from an open binary FASTQ stream.
+
+    Parameters
+    ----------
+    data : open binary file object
+        An open fastq file. Unlike ``parse_fastq``, a ``read`` method is
+        required; iterables of lines are not supported.
+    strict : bool, optional
+        Defaults to ``False``. If strict is true a FastqParse error will be
+        raised if the seq and qual labels dont' match.
+    enforce_qual_range : bool, optional
+        Defaults to ``True``. If ``True``, an exception will be raised if a
+        quality score outside the range [0, 62] is detected
+    phred_offset : {33, 64}, optional
+        What Phred offset to use when converting qual score symbols to integers
+
+    Returns
+    -------
+    label, seq, qual : (str, str, np.array)
+        yields the label, sequence and quality for each entry
+    """
+    if phred_offset != 33 and phred_offset != 64:
+        raise ValueError("Unknown PHRED offset of %s" % phred_offset)
+
+    cdef const unsigned char* p
+    cdef const char* nl
+    cdef const unsigned char* q
+    cdef Py_ssize_t pos, end, n, i, qual_n
+    cdef int state = 0
+    cdef int v, mn, mx
+    cdef bytes chunk, tail, line
+    cdef bytes seqid = None, seq = None, qualid = None, qual
+    cdef cnp.uint8_t[::1] qual_view
+    cdef bint at_eof = 0
+
+    tail = b""
+    while not at_eof:
+        chunk = data.read(_CHUNK_SIZE)
+        if not chunk:
+            # flush any final line lacking a trailing newline
+            at_eof = 1
+            if not tail:
+                break
+            chunk = tail + b"\n"
+        elif tail:
+            chunk = tail + chunk
+        tail = b""
+
+        p = chunk
+        n = len(chunk)
+        pos = 0
+        while pos < n:
+            nl = <const char*>memchr(p + pos, b'\n', n - pos)
+            if nl == NULL:
+                tail = chunk[pos:]
+                break
+            end = nl - <const char*>p
+            line = _strip(p, pos, end)
+            pos = end + 1
+
+            if state == 0:
+                # If the file simply ended in a blankline, do not error
+                if line == b'':
+                    continue
+                seqid = line
+                state = 1
+            elif state == 1:
+                seq = line
+                state = 2
+            elif state == 2:
+                qualid = line
+                state = 3
+            else:
+                qual = line
+                state = 0
+
+                if strict and seqid[1:] != qualid[1:]:
+                    raise ValueError('ID mismatch: {} != {}'.format(
+                        seqid[1:].decode('utf-8'), qualid[1:].decode('utf-8')))
+
+                # bounds based on illumina limits, see:
+                # http://nar.oxfordjournals.org/content/38/6/1767/T1.expansion.html
+                q = qual
+                qual_n = len(qual)
+                qual_arr = np.empty(qual_n, dtype=np.uint8)
+                qual_view = qual_arr
+
+                # two branch-free passes (min/max reduction, then the
+                # subtraction) so the compiler can vectorize both, rather
+                # than one scalar loop with a range test per byte
+                mn = 255
+                mx = 0
+                for i in range(qual_n):
+                    v = q[i]
+                    if v < mn:
+                        mn = v
+                    if v > mx:
+                        mx = v
+                for i in range(qual_n):
+                    qual_view[i] = <unsigned char>(q[i] - phred_offset)
+
+                if enforce_qual_range and qual_n > 0 and (
+                        mn < phred_offset or mx > phred_offset + 62):
+                    raise ValueError("Failed qual conversion for seq id: %s. "
+                                     "This may be because you passed an "
+                                     "incorrect value for phred_offset."
+                                     % seqid[1:].decode('utf-8'))
+
+                yield (seqid[1:].decode('utf-8'), seq.decode('utf-8'),
+                       qual_arr)
+
+    # Error if an incomplete record is found
+    if state != 0:
+        raise ValueError("Incomplete FASTQ record found at end of file")
@@ -0,0 +1,192 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2013--, scikit-bio development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Numba-accelerated record loop for FASTQ parsing.
+
+This is the middle tier of the parse_fastq dispatch: it is used when the
+Cython extension has not been built but numba is importable. The byte
+scanning runs as JIT-compiled native code; only record assembly happens at
+the Python level. Numba is a soft dependency, so importing this module
+raises ImportError when it is absent and callers fall back to the pure
+Python loop.
+"""
+
+import numpy as np
+from numba import njit
+
+# read size for each pass against the underlying file object
+_CHUNK_SIZE = 1048576
+
+
+@njit(cache=True)
+def _is_space(c):
+    return c == 32 or c == 9 or c == 10 or c == 13 or c == 11 or c == 12
+
+
+@njit(cache=True)
+def _scan_records(buf):
+    """Locate complete FASTQ records within a buffer of bytes
+
+    Parameters
+    ----------
+    buf : np.array of uint8
+        The buffer to scan.
+
+    Returns
+    -------
+    np.array of int64, shape (n_records, 8)
+        Whitespace-stripped (start, end) offset pairs for the label, the
+        sequence, the qual label and the qual of each complete record.
+    np.array of int64, shape (n_records, 2)
+        The min and max raw qual byte per record.
+    int
+        Offset of the first byte not consumed by a complete record;
+        callers carry buf[consumed:] into the next scan.
+    """
+    n = buf.size
+    # a record cannot be smaller than 5 bytes: the label line must hold
+    # at least one byte, but the other three lines may be empty, leaving
+    # four newlines. That bounds how many records can appear here.
+    offsets = np.empty((n // 5 + 1, 8), np.int64)
+    minmax = np.empty((n // 5 + 1, 2), np.int64)
+
+    nrec = 0
+    state = 0
+    pos = 0
+    consumed = 0
+    while pos < n:
+        end = -1
+        i = pos
+        while i < n:
+            if buf[i] == 10:
+                end = i
+                break
+            i += 1
+        if end == -1:
+            break
+
+        # strip surrounding whitespace
+        s = pos
+        e = end
+        while s < e and _is_space(buf[s]):
+            s += 1
+        while e > s and _is_space(buf[e - 1]):
+            e -= 1
+        pos = end + 1
+
+        if state == 0:
+            # If the file simply ended in a blankline, do not error
+            if s == e:
+                consumed = pos
+                continue
+            offsets[nrec, 0] = s
+            offsets[nrec, 1] = e
+            state = 1
+        elif state == 1:
+            offsets[nrec, 2] = s
+            offsets[nrec, 3] = e
+            state = 2
+        elif state == 2:
+            offsets[nrec, 4] = s
+            offsets[nrec, 5] = e
+            state = 3
+        else:
+            offsets[nrec, 6] = s
+            offsets[nrec, 7] = e
+
+            mn = 255
+            mx = 0
+            for j in range(s, e):
+                v = buf[j]
+                if v < mn:
+                    mn = v
+                if v > mx:
+                    mx = v
+            minmax[nrec, 0] = mn
+            minmax[nrec, 1] = mx
+
+            nrec += 1
+            state = 0
+            consumed = pos
+
+    return offsets[:nrec], minmax[:nrec], consumed
+
+
+def parse_fastq_nb(data, strict=False, enforce_qual_range=True,
+                   phred_offset=33):
+    r"""yields label, seq, and qual from an open binary FASTQ stream.
+
+    Parameters
+    ----------
+    data : open binary file object
+        An open fastq file. Unlike ``parse_fastq``, a ``read`` method is
+        required; iterables of lines are not supported.
+    strict : bool, optional
+        Defaults to ``False``. If strict is true a FastqParse error will be
+        raised if the seq and qual labels dont' match.
+    enforce_qual_range : bool, optional
+        Defaults to ``True``. If ``True``, an exception will be raised if a
+        quality score outside the range [0, 62] is detected
+    phred_offset : {33, 64}, optional
+        What Phred offset to use when converting qual score symbols to integers
+
+    Returns
+    -------
+    label, seq, qual : (str, str, np.array)
+        yields the label, sequence and quality for each entry
+    """
+    if phred_offset not in (33, 64):
+        raise ValueError("Unknown PHRED offset of %s" % phred_offset)
+    offset = np.uint8(phred_offset)
+
+    tail = b""
+    at_eof = False
+    while not at_eof:
+        chunk = data.read(_CHUNK_SIZE)
+        if not chunk:
+            at_eof = True
+            if not tail or tail.endswith(b"\n"):
+                # a leftover tail of complete lines is a truncated
+                # record; the check below raises on it
+                break
+            # flush a final line lacking its trailing newline
+            chunk = tail + b"\n"
+        elif tail:
+            chunk = tail + chunk
+        tail = b""
+
+        arr = np.frombuffer(chunk, np.uint8)
+        offsets, minmax, consumed = _scan_records(arr)
+        tail = chunk[consumed:]
+
+        for r in range(offsets.shape[0]):
+            rec = offsets[r]
+            seqid = chunk[rec[0] + 1:rec[1]].decode('utf-8')
+
+            if strict:
+                qualid = chunk[rec[4] + 1:rec[5]].decode('utf-8')
+                if seqid != qualid:
+                    raise ValueError('ID mismatch: {} != {}'.format(
+                        seqid, qualid))
+
+            # bounds based on illumina limits, see:
+            # http://nar.oxfordjournals.org/content/38/6/1767/T1.expansion.html
+            if enforce_qual_range and rec[7] > rec[6] and (
+                    minmax[r, 0] < phred_offset or
+                    minmax[r, 1] > phred_offset + 62):
+                raise ValueError("Failed qual conversion for seq id: %s. "
+                                 "This may be because you passed an "
+                                 "incorrect value for phred_offset." % seqid)
+
+            seq = chunk[rec[2]:rec[3]].decode('utf-8')
+            qual = arr[rec[6]:rec[7]] - offset
+
+            yield (seqid, seq, qual)
+
+    # Error if an incomplete record is found
+    if tail.strip():
+        raise ValueError("Incomplete FASTQ record found at end of file")
@@ -5,9 +5,11 @@
 #
 # The full license is in the file COPYING.txt, distributed with this software.
 # -----------------------------------------------------------------------------
+import io
+
 import numpy as np
 
-from qiita_files.util import open_file
+from qiita_files.util import open_file, mmap_lines
 
 
 def is_empty(line):
@@ -28,23 +30,52 @@ def LabeledRecordFinder(is_label_line, constructor=str.strip, ignore=is_empty):
     parsing the sets of lines returned into records to complain if a record
     is incomplete.
     """
-    def parser(lines):
-        with open_file(lines) as lines:
+    # specialize the hot loop up front: with the default constructor the
+    # line is already stripped, so the stock predicates reduce to inline
+    # comparisons and no per-line function calls remain
+    default_strip = constructor is str.strip
+    inline_ignore = default_strip and (ignore is is_empty or
+                                       ignore is is_blank_or_comment)
+    skip_comments = ignore is is_blank_or_comment
+    inline_label = default_strip and is_label_line is is_fasta_label
+
+    def parser(lines, use_mmap=True):
+        with open_file(lines, 'rb') as lines:
+            # plain on-disk files are walked through a single read-only
+            # mmap rather than the line-buffered iterator; pipes, gzip
+            # wrappers and iterables fall through to regular iteration
+            if use_mmap and isinstance(lines, io.BufferedReader):
+                mm_lines = mmap_lines(lines)
+                if mm_lines is not None:
+                    lines = mm_lines
             curr = []
             for line in lines:
-                try:
-                    line = str(line.decode('utf-8'))
-                except AttributeError:
-                    pass
-
-                if constructor is not None:
+                # the default constructor is a plain strip, which both str
+                # and bytes implement; lines from binary handles stay as
+                # bytes so no per-line decode is paid. Records are decoded
+                # downstream, once per record, where text is required.
+                if default_strip:
+                    line = line.strip()
+                elif constructor is not None:
+                    try:
+                        line = str(line.decode('utf-8'))
+                    except AttributeError:
+                        pass
                     line = constructor(line)
-                else:
-                    line = line
-                if ignore(line):
+
+                if inline_ignore:
+                    if not line or (skip_comments and
+                                    (line[:1] == b'#' or line[:1] == '#')):
+                        continue
+                elif ignore(line):
                     continue
+
                 # if we find the label, return the previous record
-                if is_label_line(line):
+                if inline_label:
+                    labelled = line[:1] == b'>' or line[:1] == '>'
+                else:
+                    labelled = is_label_line(line)
+                if labelled:
                     if curr:
                         yield curr
                         curr = []
@@ -57,15 +88,76 @@ def LabeledRecordFinder(is_label_line, constructor=str.strip, ignore=is_empty):
 
 def is_fasta_label(x):
     """Checks if x looks like a FASTA label line."""
+    if isinstance(x, bytes):
+        return x.startswith(b'>')
     return x.startswith('>')
 
 
 def is_blank_or_comment(x):
     """Checks if x is blank or a FASTA comment line."""
-    return (not x) or x.startswith('#') or x.isspace()
+    if not x:
+        return True
+    if isinstance(x, bytes):
+        return x.startswith(b'#') or x.isspace()
+    return x.startswith('#') or x.isspace()
 
 
-FastaFinder = LabeledRecordFinder(is_fasta_label, ignore=is_blank_or_comment)
+def _default_fasta_finder(lines, use_mmap=True):
+    """Yield successive FASTA records as lists of stripped lines.
+
+    Closure-free specialization of
+    ``LabeledRecordFinder(is_fasta_label, ignore=is_blank_or_comment)``:
+    every name in the hot loop is a local, with no free-variable
+    indirection per line. ``LabeledRecordFinder`` remains the way to build
+    finders with custom predicates.
+    """
+    with open_file(lines, 'rb') as lines:
+        exact = False
+        if use_mmap and isinstance(lines, io.BufferedReader):
+            mm_lines = mmap_lines(lines)
+            if mm_lines is not None:
+                lines = mm_lines
+                # mapped lines are exact slices between newlines
+                exact = True
+
+        curr = []
+        if exact:
+            # lines arrive without their newline; clean lines are
+            # appended as-is, and only lines carrying stray edge
+            # whitespace pay the full strip
+            for line in lines:
+                if line[-1:] == b'\r':
+                    line = line[:-1]
+                if not line or line.isspace():
+                    continue
+                if line[:1].isspace() or line[-1:].isspace():
+                    line = line.strip()
+                c = line[:1]
+                if c == b'#':
+                    continue
+                # if we find the label, return the previous record
+                if c == b'>':
+                    if curr:
+                        yield curr
+                        curr = []
+                curr.append(line)
+        else:
+            for line in lines:
+                line = line.strip()
+                if not line or line[:1] == b'#' or line[:1] == '#':
+                    continue
+                # if we find the label, return the previous record
+                if line[:1] == b'>' or line[:1] == '>':
+                    if curr:
+                        yield curr
+                        curr = []
+                curr.append(line)
+        # don't forget to return the last record in the file
+        if curr:
+            yield curr
+
+
+FastaFinder = _default_fasta_finder
 
 
 def parse_fasta(infile, strict=True, label_to_name=None, finder=FastaFinder,
@@ -111,9 +203,23 @@ def parse_fasta(infile, strict=True, label_to_name=None, finder=FastaFinder,
         label line with no associated sequence, or a sequence with no
         associated label line (in other words, if there is a partial record).
     """
+    # label_characters is almost always the single '>', in which case the
+    # per-record membership test reduces to one character comparison
+    label_char = label_characters if len(label_characters) == 1 else None
+
     for rec in finder(infile):
+        # records from binary sources come through as bytes; decode the
+        # label here and the joined sequence below, once per record
+        if rec and isinstance(rec[0], bytes):
+            header = rec[0].decode('utf-8')
+            is_bytes = True
+        else:
+            header = rec[0]
+            is_bytes = False
+
         # first line must be a label line
-        if not rec[0][0] in label_characters:
+        if (header[0] != label_char if label_char is not None
+                else header[0] not in label_characters):
             if strict:
                 raise ValueError(
                     "Found Fasta record without label line: %s" % rec)
@@ -128,7 +234,7 @@ def parse_fasta(infile, strict=True, label_to_name=None, finder=FastaFinder,
                 continue
 
         # remove the label character from the beginning of the label
-        label = rec[0][1:].strip()
+        label = header[1:].strip()
         # if the user passed a label_to_name function, apply that to the label
         if label_to_name is not None:
             label = label_to_name(label)
@@ -140,12 +246,49 @@ def parse_fasta(infile, strict=True, label_to_name=None, finder=FastaFinder,
         else:
             pass
 
-        # join the sequence lines into a single string
-        seq = ''.join(rec[1:])
+        # join the sequence lines into a single string; join measures the
+        # lines first and fills one exactly-sized buffer, so no growth
+        # reallocations happen even for 100k-line contigs
+        if is_bytes:
+            seq = b''.join(rec[1:])
+            # release the per-line objects before decoding so that peak
+            # memory holds two copies of a huge contig, not three
+            del rec[1:]
+            seq = seq.decode('utf-8')
+        else:
+            seq = ''.join(rec[1:])
 
         yield label, seq
 
 
+def parse_fasta_headers(infile):
+    r"""Generator of sequence identifiers from a fasta file.
+
+    This is the fast path when only the IDs are needed (e.g., duplicate
+    checks, counting, or indexing): sequence lines are skipped without
+    being accumulated or joined, so the cost is bound by line scanning
+    rather than by sequence assembly.
+
+    Parameters
+    ----------
+    infile : open file object or str
+        An open fasta file or a path to a fasta file.
+
+    Returns
+    -------
+    str
+        yields the identifier (first whitespace separated field of the
+        header line) for each record.
+    """
+    with open_file(infile, 'rb') as lines:
+        for line in lines:
+            if isinstance(line, str):
+                line = line.encode('utf-8')
+            if line.startswith(b'>'):
+                fields = line[1:].split(None, 1)
+                yield fields[0].decode('utf-8') if fields else ''
+
+
 def parse_qual(infile, full_header=False):
     r"""yields label and qual from a qual file.
 
@@ -165,10 +308,17 @@ def parse_qual(infile, full_header=False):
     """
 
     for rec in FastaFinder(infile):
-        curr_id = rec[0][1:]
-        curr_qual = ' '.join(rec[1:])
+        header = rec[0]
+        if isinstance(header, bytes):
+            header = header.decode('utf-8')
+        curr_id = header[1:]
+
+        # stream tokens straight into the array: no joined intermediate
+        # string and no materialized list of per-score strings. int()
+        # accepts bytes tokens, so score lines are never decoded.
         try:
-            parts = np.asarray(curr_qual.split(), dtype=int)
+            parts = np.fromiter((int(token) for line in rec[1:]
+                                 for token in line.split()), dtype=int)
         except ValueError:
             raise ValueError(
                 "Invalid qual file. Check the format of the qual file: each "
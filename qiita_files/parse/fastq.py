@@ -6,14 +6,42 @@
 # The full license is in the file COPYING.txt, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import io
+
 import numpy as np
-from qiita_files.util import open_file
-from itertools import zip_longest
+from qiita_files.util import open_file, mmap_lines, ReadaheadReader
+
+try:
+    from qiita_files.parse._fastq_cy import parse_fastq_cy as _parse_fastq_cy
+except ImportError:
+    # optional compiled parser; fall back to numba, then pure Python
+    _parse_fastq_cy = None
 
+if _parse_fastq_cy is None:
+    try:
+        from qiita_files.parse._fastq_numba import \
+            parse_fastq_nb as _parse_fastq_chunked
+    except ImportError:
+        _parse_fastq_chunked = None
+else:
+    _parse_fastq_chunked = _parse_fastq_cy
 
-def _ascii_to_phred(s, offset):
-    """Convert ascii to Phred quality score with specified ASCII offset."""
-    return np.frombuffer(s, dtype='|S1').view(np.int8) - offset
+
+# translation tables mapping ASCII qual characters directly to Phred scores.
+# bytes.translate is a single C loop over a 256-byte LUT, which is notably
+# cheaper per record than a numpy subtraction. The subtraction wraps modulo
+# 256, so characters below the offset land well above 62 and are still
+# caught by the range check in parse_fastq.
+_PHRED33_TABLE = bytes.maketrans(bytes(range(256)),
+                                 bytes((c - 33) & 0xff for c in range(256)))
+_PHRED64_TABLE = bytes.maketrans(bytes(range(256)),
+                                 bytes((c - 64) & 0xff for c in range(256)))
+
+
+def _ascii_to_phred(s, table):
+    """Convert ascii to Phred quality score with specified translation table.
+    """
+    return np.frombuffer(s.translate(table), dtype=np.uint8)
 
 
 def ascii_to_phred33(s):
@@ -22,7 +50,7 @@ def ascii_to_phred33(s):
     versions after 1.8.0, and most other places. Note that internal Illumina
     files still use offset of 64
     """
-    return _ascii_to_phred(s, 33)
+    return _ascii_to_phred(s, _PHRED33_TABLE)
 
 
 def ascii_to_phred64(s):
@@ -31,7 +59,7 @@ def ascii_to_phred64(s):
     versions prior to 1.8.0, and in Illumina internal formats (e.g.,
     export.txt files).
     """
-    return _ascii_to_phred(s, 64)
+    return _ascii_to_phred(s, _PHRED64_TABLE)
 
 
 def _drop_id_marker(s):
@@ -66,23 +94,150 @@ def parse_fastq(data, strict=False, enforce_qual_range=True, phred_offset=33):
     """
 
     if phred_offset == 33:
-        phred_f = ascii_to_phred33
+        table = _PHRED33_TABLE
     elif phred_offset == 64:
-        phred_f = ascii_to_phred64
+        table = _PHRED64_TABLE
     else:
         raise ValueError("Unknown PHRED offset of %s" % phred_offset)
 
     with open_file(data, 'rb') as data:
-        iters = [iter(data)] * 4
-        for seqid, seq, qualid, qual in zip_longest(*iters):
+        # the chunked parsers (Cython, or JIT compiled when the extension
+        # is not built) read in bulk, so they require a real stream; an
+        # iterable of lines still goes through the Python loop below
+        if _parse_fastq_chunked is not None and hasattr(data, 'read'):
+            # prefetch chunks from a background thread so that disk (or
+            # decompression) and parsing overlap
+            with ReadaheadReader(data) as reader:
+                yield from _parse_fastq_chunked(reader, strict,
+                                               enforce_qual_range,
+                                               phred_offset)
+            return
+
+        # without the extension, plain on-disk files are still walked
+        # through a single read-only mmap instead of the line-buffered
+        # iterator; anything unmappable falls back to regular iteration
+        if isinstance(data, io.BufferedReader):
+            mm_lines = mmap_lines(data)
+            if mm_lines is not None:
+                data = mm_lines
+
+        yield from _parse_fastq_py(data, table, phred_offset, strict,
+                                   enforce_qual_range)
+
+
+def _parse_fastq_py(data, table, phred_offset, strict, enforce_qual_range):
+    """Pure Python record loop
+
+    The caller resolves ``phred_offset`` to a concrete translation table
+    once, so the loop body only touches locals: no per-record branching on
+    the offset and no indirection through a conversion function.
+    """
+    hi = phred_offset + 62
+
+    # group lines explicitly rather than through the zip_longest iter
+    # trick: no 4-tuple construction or fill-value checks per record
+    data = iter(data)
+    for seqid in data:
+        seqid = seqid.strip()
+        # If the file simply ended in a blankline, do not error
+        if seqid == b'':
+            continue
+
+        seq = next(data, None)
+        qualid = next(data, None)
+        qual = next(data, None)
+        # Error if an incomplete record is found
+        if seq is None or qualid is None or qual is None:
+            raise ValueError("Incomplete FASTQ record found at end "
+                             "of file")
+
+        seq = seq.strip()
+        qualid = qualid.strip()
+        qual = qual.strip()
+
+        seqid = _drop_id_marker(seqid)
+
+        try:
+            seq = str(seq.decode("utf-8"))
+        except AttributeError:
+            pass
+
+        qualid = _drop_id_marker(qualid)
+        if strict:
+            if seqid != qualid:
+                raise ValueError('ID mismatch: {} != {}'.format(
+                    seqid, qualid))
+
+        # bounds based on illumina limits, see:
+        # http://nar.oxfordjournals.org/content/38/6/1767/T1.expansion.html
+        # validate on the raw ASCII bytes before converting: min/max of
+        # bytes are single C-level reductions, avoiding the two boolean
+        # temporaries that (qual < 0).any() / (qual > 62).any() allocate
+        if enforce_qual_range and qual and (
+                min(qual) < phred_offset or max(qual) > hi):
+            raise ValueError("Failed qual conversion for seq id: %s. "
+                             "This may be because you passed an incorrect "
+                             "value for phred_offset." % seqid)
+        qual = np.frombuffer(qual.translate(table), dtype=np.uint8)
+
+        yield (seqid, seq, qual)
+
+
+def parse_fastq_into(data, out_buf=None, strict=False,
+                     enforce_qual_range=True, phred_offset=33):
+    r"""yields label, seq, and qual, reusing one quality buffer throughout.
+
+    Variant of ``parse_fastq`` for reduction-style consumers (mean qual,
+    trimming) that never need to own a record's scores: instead of
+    allocating a fresh array per record, scores are written into a single
+    backing buffer and yielded as a view into it.
+
+    Parameters
+    ----------
+    data : open file object or str
+        An open fastq file (opened in binary mode) or a path to it.
+    out_buf : bytearray, optional
+        The backing store for the quality scores. Grown as needed when not
+        provided or too small.
+    strict : bool, optional
+        Defaults to ``False``. If strict is true a FastqParse error will be
+        raised if the seq and qual labels dont' match.
+    enforce_qual_range : bool, optional
+        Defaults to ``True``. If ``True``, an exception will be raised if a
+        quality score outside the range [0, 62] is detected
+    phred_offset : {33, 64}, optional
+        What Phred offset to use when converting qual score symbols to integers
+
+    Returns
+    -------
+    label, seq, qual : (str, str, np.array)
+        yields the label, sequence and quality for each entry. The qual
+        array is a uint8 view into the shared buffer and is overwritten on
+        the next iteration; copy it if it must outlive the step.
+    """
+    if phred_offset not in (33, 64):
+        raise ValueError("Unknown PHRED offset of %s" % phred_offset)
+    hi = phred_offset + 62
+
+    if out_buf is None:
+        out_buf = bytearray(1024)
+    out = np.frombuffer(out_buf, dtype=np.uint8)
+
+    with open_file(data, 'rb') as data:
+        if isinstance(data, io.BufferedReader):
+            mm_lines = mmap_lines(data)
+            if mm_lines is not None:
+                data = mm_lines
+
+        data = iter(data)
+        for seqid in data:
             seqid = seqid.strip()
-            # If the file simply ended in a blankline, do not error
             if seqid == b'':
                 continue
-            # Error if an incomplete record is found
-            # Note: seqid cannot be None, because if all 4 values were None,
-            # then the loop condition would be false, and we could not have
-            # gotten to this point
+
+            seq = next(data, None)
+            qualid = next(data, None)
+            qual = next(data, None)
             if seq is None or qualid is None or qual is None:
                 raise ValueError("Incomplete FASTQ record found at end "
                                  "of file")
@@ -98,18 +253,85 @@ def parse_fastq(data, strict=False, enforce_qual_range=True, phred_offset=33):
             except AttributeError:
                 pass
 
-            qualid = _drop_id_marker(qualid)
             if strict:
-                if seqid != qualid:
+                if seqid != _drop_id_marker(qualid):
                     raise ValueError('ID mismatch: {} != {}'.format(
-                        seqid, qualid))
+                        seqid, _drop_id_marker(qualid)))
 
-            # bounds based on illumina limits, see:
-            # http://nar.oxfordjournals.org/content/38/6/1767/T1.expansion.html
-            qual = phred_f(qual)
-            if enforce_qual_range and ((qual < 0).any() or (qual > 62).any()):
+            if enforce_qual_range and qual and (
+                    min(qual) < phred_offset or max(qual) > hi):
                 raise ValueError("Failed qual conversion for seq id: %s. "
-                                 "This may be because you passed an incorrect "
-                                 "value for phred_offset." % seqid)
+                                 "This may be because you passed an "
+                                 "incorrect value for phred_offset." % seqid)
+
+            n = len(qual)
+            if n > out.size:
+                out_buf = bytearray(max(n, 2 * out.size))
+                out = np.frombuffer(out_buf, dtype=np.uint8)
+
+            # one memcpy into the reused store, then an in-place subtract:
+            # no per-record array or translated-bytes allocation
+            view = out[:n]
+            view[...] = np.frombuffer(qual, dtype=np.uint8)
+            np.subtract(view, np.uint8(phred_offset), out=view)
+
+            yield (seqid, seq, view)
+
+
+def _make_batch(ids, seqs, quals):
+    """Assemble a structure-of-arrays batch from accumulated records"""
+    lengths = np.fromiter((len(q) for q in quals), dtype=np.int64,
+                          count=len(quals))
+    offsets = np.zeros(len(quals) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    if quals:
+        flat = np.concatenate(quals)
+    else:
+        flat = np.empty(0, dtype=np.uint8)
+
+    return {'ids': ids, 'seqs': seqs, 'quals': flat, 'offsets': offsets}
+
+
+def parse_fastq_batched(data, batch_size=65536, **kwargs):
+    r"""yields batches of records from a fastq file in columnar layout.
+
+    Downstream numpy consumers (quality statistics, length histograms,
+    trimming) otherwise pay per-record Python overhead to re-batch the
+    tuples from ``parse_fastq``; this variant accumulates and hands over
+    whole columns at a time.
+
+    Parameters
+    ----------
+    data : open file object or str
+        An open fastq file (opened in binary mode) or a path to it.
+    batch_size : unsigned int, optional
+        The maximum number of records per batch.
+    kwargs : dict
+        Passed through to ``parse_fastq``.
+
+    Returns
+    -------
+    dict
+        yields one dict per batch with the keys:
+
+        * ids : list of str, the sequence identifiers
+        * seqs : list of str, the sequences
+        * quals : np.array of uint8, all quality scores of the batch,
+          concatenated
+        * offsets : np.array of int64, of length ``len(ids) + 1``; the
+          scores of record ``i`` are ``quals[offsets[i]:offsets[i + 1]]``
+    """
+    ids, seqs, quals = [], [], []
+
+    for seqid, seq, qual in parse_fastq(data, **kwargs):
+        ids.append(seqid)
+        seqs.append(seq)
+        quals.append(qual)
+
+        if len(ids) >= batch_size:
+            yield _make_batch(ids, seqs, quals)
+            ids, seqs, quals = [], [], []
 
-            yield (seqid, seq, qual)
+    if ids:
+        yield _make_batch(ids, seqs, quals)
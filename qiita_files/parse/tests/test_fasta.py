@@ -12,7 +12,8 @@ from unittest import TestCase, main
 
 import numpy.testing as npt
 
-from qiita_files.parse.fasta import parse_fasta, parse_qual
+from qiita_files.parse.fasta import (parse_fasta, parse_fasta_headers,
+                                     parse_qual)
 
 
 FASTA_PARSERS_DATA = {
@@ -23,6 +24,8 @@ FASTA_PARSERS_DATA = {
     'twogood': '>123\n\n> \t abc  \t \ncag\ngac\n>456\nc\ng',
     'oneX': '>123\nX\n> \t abc  \t \ncag\ngac\n>456\nc\ng',
     'nolabels': 'GJ>DSJGSJDF\nSFHKLDFS>jkfs\n',
+    'trailingws': '>a\nAC \nGT\t\n>b\nU CAG\n',
+    'leadingws': '  >a\nAC\n\t>b\nGT\n',
     'empty': '',
     'qualscores': '>x\n5 10 5\n12\n>y foo bar\n30 40\n>a   \n5 10 5\n12\n'
                   '>b  baz\n30 40',
@@ -143,6 +146,16 @@ class ParseFastaTests(object):
         self.assertEqual(b, ('abc', 'caggac'))
         self.assertEqual(c, ('456', 'cg'))
 
+    def test_trailing_whitespace(self):
+        """parse_fasta strips trailing whitespace from sequence lines"""
+        f = list(parse_fasta(self.trailingws))
+        self.assertEqual(f, [('a', 'ACGT'), ('b', 'U CAG')])
+
+    def test_leading_whitespace_label(self):
+        """parse_fasta recognizes labels preceded by whitespace"""
+        f = list(parse_fasta(self.leadingws))
+        self.assertEqual(f, [('a', 'AC'), ('b', 'GT')])
+
     def test_multiple_bad_strict(self):
         with self.assertRaises(ValueError):
             list(parse_fasta(self.twogood))
@@ -153,6 +166,14 @@ class ParseFastaTests(object):
         a, b = f
         self.assertEqual(a, ('abc', 'caggac'))
 
+    def test_parse_fasta_headers(self):
+        """parse_fasta_headers yields only the record identifiers"""
+        self.assertEqual(list(parse_fasta_headers(self.threeseq)),
+                         ['123', 'abc', '456'])
+        self.assertEqual(list(parse_fasta_headers(self.qualscores)),
+                         ['x', 'y', 'a', 'b'])
+        self.assertEqual(list(parse_fasta_headers(self.empty)), [])
+
     def test_parse_qual(self):
         exp = [('x', [5, 10, 5, 12]), ('y', [30, 40]), ('a', [5, 10, 5, 12]),
                ('b', [30, 40])]
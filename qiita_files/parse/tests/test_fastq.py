@@ -11,7 +11,8 @@ import tempfile
 
 from numpy import array
 
-from qiita_files.parse.fastq import parse_fastq
+from qiita_files.parse.fastq import (parse_fastq, parse_fastq_batched,
+                                     parse_fastq_into)
 
 
 class IterableData(object):
@@ -20,6 +21,7 @@ class IterableData(object):
         self.FASTQ_EXAMPLE = FASTQ_EXAMPLE.split(b'\n')
         self.FASTQ_EXAMPLE_2 = FASTQ_EXAMPLE_2.split(b'\n')
         self.FASTQ_EXAMPLE_3 = FASTQ_EXAMPLE_3.split(b'\n')
+        self.FASTQ_EXAMPLE_4 = FASTQ_EXAMPLE_4.split(b'\n')
 
 
 class FileData(object):
@@ -28,7 +30,8 @@ class FileData(object):
         tmp_files = []
         for attr, val in [('FASTQ_EXAMPLE', FASTQ_EXAMPLE),
                           ('FASTQ_EXAMPLE_2', FASTQ_EXAMPLE_2),
-                          ('FASTQ_EXAMPLE_3', FASTQ_EXAMPLE_3)]:
+                          ('FASTQ_EXAMPLE_3', FASTQ_EXAMPLE_3),
+                          ('FASTQ_EXAMPLE_4', FASTQ_EXAMPLE_4)]:
             tmp_file = tempfile.NamedTemporaryFile('wb')
             tmp_file.write(val)
             tmp_file.flush()
@@ -76,13 +79,60 @@ class ParseFastqTests(object):
         with self.assertRaises(ValueError):
             list(parse_fastq(self.FASTQ_EXAMPLE, phred_offset=42))
 
+    def test_parse_into_buffer(self):
+        for label, seq, qual in parse_fastq_into(self.FASTQ_EXAMPLE,
+                                                 phred_offset=64):
+            self.assertTrue(label in DATA)
+            self.assertEqual(seq, DATA[label]["seq"])
+            self.assertTrue((qual == DATA[label]["qual"]).all())
+
+        # the yielded qual is a view that the next record overwrites
+        gen = parse_fastq_into(self.FASTQ_EXAMPLE, phred_offset=64)
+        first = next(gen)[2]
+        first_copy = first.copy()
+        next(gen)
+        self.assertFalse((first == first_copy).all())
+
+    def test_parse_degenerate_records(self):
+        # minimal 5 byte records: one byte of label, the other three
+        # lines empty; enough of them to overrun an undersized scan
+        obs = list(parse_fastq(self.FASTQ_EXAMPLE_4))
+
+        self.assertEqual(len(obs), 5000)
+        for label, seq, qual in obs:
+            self.assertEqual(label, '')
+            self.assertEqual(seq, '')
+            self.assertEqual(len(qual), 0)
+
+    def test_parse_batched(self):
+        batches = list(parse_fastq_batched(self.FASTQ_EXAMPLE, batch_size=4,
+                                           phred_offset=64))
+        self.assertEqual([len(b['ids']) for b in batches], [4, 4, 2])
+
+        for batch in batches:
+            offsets = batch['offsets']
+            for i, (label, seq) in enumerate(zip(batch['ids'],
+                                                 batch['seqs'])):
+                self.assertTrue(label in DATA)
+                self.assertEqual(seq, DATA[label]["seq"])
+                qual = batch['quals'][offsets[i]:offsets[i + 1]]
+                self.assertTrue((qual == DATA[label]["qual"]).all())
+
 
 class ParseFastqTestsInputIsIterable(IterableData, ParseFastqTests, TestCase):
     pass
 
 
 class ParseFastqTestsInputIsFileNames(FileData, ParseFastqTests, TestCase):
-    pass
+
+    def test_parse_truncated_record(self):
+        # a file cut off mid-record after complete lines must raise,
+        # not yield a record with a fabricated empty qual line
+        with tempfile.NamedTemporaryFile('wb') as f:
+            f.write(b"@x\nAC\n+\n")
+            f.flush()
+            with self.assertRaises(ValueError):
+                list(parse_fastq(f.name))
 
 
 DATA = {
@@ -215,6 +265,8 @@ AACACCAAACTTCTCCACCACGTGAGCTACAAAAG
 @GAPC_0015:6:1:1283:11957#0/1
 """
 
+FASTQ_EXAMPLE_4 = b"A\n\n\n\n" * 5000
+
 
 if __name__ == "__main__":
     main()
@@ -17,11 +17,13 @@ import h5py
 import numpy as np
 import numpy.testing as npt
 
+import qiita_files.demux as demux
 from qiita_files.demux import (buffer1d, buffer2d, _has_qual,
                                _per_sample_lengths, _summarize_lengths,
                                _set_attr_stats, _construct_datasets, to_hdf5,
                                to_ascii, stat, to_per_sample_ascii,
-                               to_per_sample_files, to_ascii_file)
+                               to_per_sample_files, to_ascii_file,
+                               barcode_mismatches)
 
 
 class BufferTests(TestCase):
@@ -71,6 +73,49 @@ class BufferTests(TestCase):
         npt.assert_equal(b1d._buf, exp1d)
         npt.assert_equal(b2d._buf, exp2d)
 
+    def test_write_many(self):
+        b1d = buffer1d(self.dset_1d, max_fill=10)
+        b2d = buffer2d(self.dset_2d, max_fill=10)
+
+        b1d.write_many(np.arange(9))
+        b2d.write_many([np.arange(i+1) for i in np.arange(9)])
+
+        exp1d = np.zeros(10, dtype=int)
+        exp1d[:9] = np.arange(9)
+        exp2d = np.zeros((10, 100), dtype=int)
+        exp2d[:9, :9] = np.tril(np.repeat(np.arange(9), 9).reshape(9, 9).T)
+
+        npt.assert_equal(b1d._buf, exp1d)
+        npt.assert_equal(b2d._buf, exp2d)
+
+        # spills over the max fill and flushes the first ten elements
+        b1d.write_many(np.arange(2))
+        b2d.write_many([np.arange(i+1) for i in np.arange(2)])
+
+        exp1d = np.zeros(10, dtype=int)
+        exp1d[0] = 1
+        exp2d = np.zeros((10, 100), dtype=int)
+        exp2d[0, 1] = 1
+
+        npt.assert_equal(b1d._buf, exp1d)
+        npt.assert_equal(b2d._buf, exp2d)
+
+        npt.assert_equal(self.dset_1d[:10],
+                         np.concatenate([np.arange(9), [0]]))
+
+    def test_write_into(self):
+        b2d = buffer2d(self.dset_2d, max_fill=10)
+
+        scratch = np.zeros(100, dtype=int)
+        for i in np.arange(9):
+            scratch[:i+1] = np.arange(i+1)
+            b2d.write_into(scratch, i+1)
+
+        exp2d = np.zeros((10, 100), dtype=int)
+        exp2d[:9, :9] = np.tril(np.repeat(np.arange(9), 9).reshape(9, 9).T)
+
+        npt.assert_equal(b2d._buf, exp2d)
+
     def test_is_full(self):
         b1d = buffer1d(self.dset_1d, max_fill=10)
         b2d = buffer2d(self.dset_2d, max_fill=10)
@@ -150,6 +195,18 @@ class DemuxTests(TestCase):
 
             self.assertTrue(_has_qual(f.name))
 
+    def test_barcode_mismatches(self):
+        original = np.array([b'abc', b'aby', b'abz'], dtype='S12')
+        corrected = np.array([b'abc', b'ybc', b'zbc'], dtype='S12')
+
+        obs = barcode_mismatches(original, corrected)
+        npt.assert_equal(obs, np.array([0, 2, 2]))
+
+        # mixed widths are padded to the wider dtype before comparing
+        obs = barcode_mismatches(np.array([b'ab'], dtype='S2'),
+                                 np.array([b'abcd'], dtype='S4'))
+        npt.assert_equal(obs, np.array([2]))
+
     def test_per_sample_lengths(self):
         with tempfile.NamedTemporaryFile('wb', suffix='.fna') as f:
             f.write(seqdata)
@@ -258,8 +315,8 @@ class DemuxTests(TestCase):
 
         npt.assert_equal(self.hdf5_file['a/sequence'][:],
                          np.array([b"x", b"xy", b"xyz"]))
-        npt.assert_equal(self.hdf5_file['a/qual'][:],
-                         np.array([[0, 0, 0], [0, 0, 0], [0, 0, 0]]))
+        # fasta input carries no qual, so the dataset is not created
+        self.assertFalse('a/qual' in self.hdf5_file)
         npt.assert_equal(self.hdf5_file['a/barcode/original'][:],
                          np.array([b"abc", b"aby", b"abz"]))
         npt.assert_equal(self.hdf5_file['a/barcode/corrected'][:],
@@ -269,8 +326,7 @@ class DemuxTests(TestCase):
 
         npt.assert_equal(self.hdf5_file['b/sequence'][:],
                          np.array([b"xyz", b"abcd"]))
-        npt.assert_equal(self.hdf5_file['b/qual'][:],
-                         np.array([[0, 0, 0, 0], [0, 0, 0, 0]]))
+        self.assertFalse('b/qual' in self.hdf5_file)
         npt.assert_equal(self.hdf5_file['b/barcode/original'][:],
                          np.array([b"abx", b"abw"]))
         npt.assert_equal(self.hdf5_file['b/barcode/corrected'][:],
@@ -278,6 +334,30 @@ class DemuxTests(TestCase):
         npt.assert_equal(self.hdf5_file['b/barcode/error'][:],
                          np.array([1, 4]))
 
+    def test_to_hdf5_spilled(self):
+        # force every sample past the staging budget so the records
+        # stream through the incremental buffers, in tiny batches
+        budget, batch = demux._STAGE_BUDGET, demux._SPILL_BATCH
+        demux._STAGE_BUDGET = 0
+        demux._SPILL_BATCH = 2
+        try:
+            with tempfile.NamedTemporaryFile('wb', suffix='.fq',
+                                             delete=False) as f:
+                f.write(fqdata)
+
+            self.to_remove.append(f.name)
+            to_hdf5(f.name, self.hdf5_file)
+        finally:
+            demux._STAGE_BUDGET = budget
+            demux._SPILL_BATCH = batch
+
+        exp = [b"@a_0 orig_bc=abc new_bc=abc bc_diffs=0\nxyz\n+\nABC\n",
+               b"@b_0 orig_bc=abw new_bc=wbc bc_diffs=4\nqwe\n+\nDFG\n",
+               b"@b_1 orig_bc=abw new_bc=wbc bc_diffs=4\nqwe\n+\nDEF\n"]
+
+        obs = list(to_ascii(self.hdf5_file, samples=[b'a', b'b']))
+        self.assertEqual(obs, exp)
+
     def test_to_ascii(self):
         with tempfile.NamedTemporaryFile('wb', suffix='.fq',
                                          delete=False) as f:
@@ -310,6 +390,41 @@ class DemuxTests(TestCase):
         obs = list(to_ascii(self.hdf5_file, samples=[b'a', b'b']))
         self.assertEqual(obs, exp)
 
+    def test_to_ascii_long_sample_name(self):
+        # exercises the oversized-header fallback of the compiled
+        # serializer; names this long do not fit its fixed header buffer
+        name = 'S' * 1100
+        data = ("@%s_1 orig_bc=abc new_bc=abc bc_diffs=0\nxyz\n+\nABC\n"
+                % name).encode()
+        with tempfile.NamedTemporaryFile('wb', suffix='.fq',
+                                         delete=False) as f:
+            f.write(data)
+
+        self.to_remove.append(f.name)
+        to_hdf5(f.name, self.hdf5_file)
+
+        exp = [("@%s_0 orig_bc=abc new_bc=abc bc_diffs=0\nxyz\n+\nABC\n"
+                % name).encode()]
+        obs = list(to_ascii(self.hdf5_file, samples=[name.encode()]))
+        self.assertEqual(obs, exp)
+
+        # same fallback on the fasta serializer
+        data = (">%s_1 orig_bc=abc new_bc=abc bc_diffs=0\nxyz\n"
+                % name).encode()
+        with tempfile.NamedTemporaryFile('wb', suffix='.fna',
+                                         delete=False) as f:
+            f.write(data)
+
+        self.to_remove.append(f.name)
+        with h5py.File('test_fasta', mode='w', driver='core',
+                       backing_store=False) as fasta_demux:
+            to_hdf5(f.name, fasta_demux)
+
+            exp = [(">%s_0 orig_bc=abc new_bc=abc bc_diffs=0\nxyz\n"
+                    % name).encode()]
+            obs = list(to_ascii(fasta_demux, samples=[name.encode()]))
+            self.assertEqual(obs, exp)
+
     def test_to_per_sample_ascii(self):
         with tempfile.NamedTemporaryFile('wb', suffix='.fq',
                                          delete=False) as f:
@@ -14,7 +14,8 @@ import tempfile
 import h5py
 from io import StringIO, BytesIO
 
-from qiita_files.util import (open_file, _is_string_or_bytes)
+from qiita_files.util import (open_file, _is_string_or_bytes,
+                              ReadaheadReader)
 
 
 def mock_sequence_iter(items):
@@ -93,6 +94,34 @@ class TestFilePathOpening(TestCase):
         os.remove(name)
 
 
+class ReadaheadReaderTests(TestCase):
+    def test_read(self):
+        data = b'0123456789' * 1000
+        with ReadaheadReader(BytesIO(data), chunk_size=64) as reader:
+            obs = b''
+            chunk = reader.read()
+            while chunk:
+                obs += chunk
+                chunk = reader.read()
+        self.assertEqual(obs, data)
+
+        # reads at EOF keep returning the empty string
+        self.assertEqual(reader.read(), b'')
+
+    def test_read_empty(self):
+        with ReadaheadReader(BytesIO(b'')) as reader:
+            self.assertEqual(reader.read(), b'')
+
+    def test_read_propagates_errors(self):
+        class ExplodingFile(object):
+            def read(self, size):
+                raise IOError("boom")
+
+        with ReadaheadReader(ExplodingFile()) as reader:
+            with self.assertRaises(IOError):
+                reader.read()
+
+
 # comment indicates the expected random value
 sequences = [
     ('a_1', 'AATTGGCC-a1'),  # 2, 3624216819017203053
@@ -6,28 +6,261 @@
 # The full license is in the file LICENSE, distributed with this software.
 # -----------------------------------------------------------------------------
 
+import io
+import mmap
+import os
+import queue
+import threading
 from contextlib import contextmanager
 
 import h5py
 
 
-# not present in all 2.x series
-if hasattr(h5py.get_config(), 'default_file_mode'):
+# capability probe, resolved once at import: default_file_mode is not
+# present in all 2.x series and was removed in h5py 3.3. Sniffing the
+# config object is both cheaper and more robust than parsing
+# h5py.__version__, which chokes on pre-release strings like '3.10.0rc1'
+_H5PY_HAS_DEFAULT_FILE_MODE = hasattr(h5py.get_config(), 'default_file_mode')
+
+# mutating the process-global h5py config from an import surprises
+# embedding applications and is re-executed by every worker subprocess;
+# open_file instead passes an explicit read-only mode. The old global
+# behavior remains available for deployments that relied on it.
+if _H5PY_HAS_DEFAULT_FILE_MODE and os.environ.get(
+        'QIITA_FILES_SET_READ_MODE'):
     h5py.get_config().default_file_mode = 'r'
 
 
+def _iter_mmap_lines(mm, block_size=1048576):
+    """Walk a read-only mmap and yield lines of bytes, sans newline
+
+    Lines are materialized a block at a time with a single split call per
+    block: one vectorized C pass over the data rather than a Python-level
+    find+slice per line.
+    """
+    try:
+        n = len(mm)
+        pos = 0
+        tail = b''
+        while pos < n:
+            block = mm[pos:pos + block_size]
+            pos += len(block)
+
+            lines = block.split(b'\n')
+            lines[0] = tail + lines[0]
+            # the last element is either an incomplete line continuing
+            # into the next block, or empty if the block ended on \n
+            tail = lines.pop()
+
+            yield from lines
+
+        if tail:
+            yield tail
+    finally:
+        mm.close()
+
+
+def mmap_lines(fh):
+    """Iterate the lines of a binary file handle through a single mmap
+
+    Parameters
+    ----------
+    fh : file object
+        An open binary file handle backed by a real file descriptor.
+
+    Returns
+    -------
+    generator of bytes or None
+        Yields one bytes object per line, without the trailing newline.
+        None is returned when the handle cannot be mapped (e.g., pipes or
+        compressed wrappers), in which case callers should fall back to
+        regular line iteration.
+
+    Notes
+    -----
+    Walking the map with ``find`` avoids the Python line-buffered iterator
+    machinery, which allocates and tracks a buffered line object per
+    iteration on top of the raw reads.
+    """
+    try:
+        size = os.fstat(fh.fileno()).st_size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+    # cannot mmap an empty file, but there is nothing to yield anyway
+    if size == 0:
+        return iter(())
+
+    try:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        return None
+
+    # single-pass scans never revisit data: ask the kernel for aggressive
+    # readahead and early page eviction. Not available on all platforms.
+    if hasattr(mm, 'madvise'):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+        mm.madvise(mmap.MADV_WILLNEED)
+
+    return _iter_mmap_lines(mm)
+
+
+class ReadaheadReader(object):
+    """Read a file object through a background prefetch thread
+
+    Parameters
+    ----------
+    fh : file object
+        The file object to read from. The handle is not owned and is not
+        closed by this object.
+    chunk_size : unsigned int, optional
+        The number of bytes requested per read.
+    depth : unsigned int, optional
+        The maximum number of chunks buffered ahead of the consumer.
+
+    Notes
+    -----
+    A cold-cache sequential scan otherwise alternates between blocking on
+    the disk and parsing; prefetching up to `depth` chunks from a separate
+    thread overlaps the two. The reading thread releases the GIL while
+    blocked in the underlying read, so the consumer parses concurrently.
+    Reads are advised as sequential to the kernel where supported.
+    """
+    def __init__(self, fh, chunk_size=4194304, depth=8):
+        self._fh = fh
+        self._chunk_size = chunk_size
+        self._queue = queue.Queue(maxsize=depth)
+        self._stopped = False
+        self._eof = False
+
+        if hasattr(os, 'posix_fadvise'):
+            try:
+                fd = fh.fileno()
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            except (AttributeError, OSError, io.UnsupportedOperation):
+                pass
+
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _fill(self):
+        """Producer loop; exceptions are forwarded to the consumer"""
+        while not self._stopped:
+            try:
+                chunk = self._fh.read(self._chunk_size)
+            except Exception as e:  # re-raised from read()
+                chunk = e
+
+            while not self._stopped:
+                try:
+                    self._queue.put(chunk, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+            if not isinstance(chunk, bytes) or not chunk:
+                return
+
+    def read(self, size=-1):
+        """Return the next prefetched chunk
+
+        Parameters
+        ----------
+        size : int, optional
+            Present for file object compatibility; reads return up to
+            `chunk_size` bytes regardless.
+
+        Returns
+        -------
+        bytes
+            The next chunk, or b'' at EOF.
+        """
+        if self._eof:
+            return b''
+
+        chunk = self._queue.get()
+        if isinstance(chunk, Exception):
+            self._eof = True
+            raise chunk
+        if not chunk:
+            self._eof = True
+
+        return chunk
+
+    def close(self):
+        """Stop the prefetch thread; the underlying handle stays open"""
+        self._stopped = True
+        # unblock the producer if it is waiting on a full queue
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 def _is_string_or_bytes(s):
     """Returns True if input argument is string (unicode or not) or bytes.
     """
     return isinstance(s, str) or isinstance(s, bytes)
 
 
+# the HDF5 superblock signature; it sits at offset 0 for files written
+# by h5py and at doubling offsets from 512 for files with a userblock
+_HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+
+def _is_hdf5(filepath):
+    """Check for the HDF5 file signature
+
+    Equivalent to ``h5py.is_hdf5`` for any file this package produces,
+    but a single open and a handful of 8 byte reads rather than a round
+    trip through the HDF5 library; _get_filehandle sniffs every path it
+    is given, so this sits on the open hot path of the parallel workers.
+    """
+    try:
+        with open(filepath, 'rb') as fh:
+            if fh.read(8) == _HDF5_SIGNATURE:
+                return True
+
+            offset = 512
+            while offset <= 65536:
+                fh.seek(offset)
+                if fh.read(8) == _HDF5_SIGNATURE:
+                    return True
+                offset *= 2
+    except OSError:
+        # missing or unreadable; let the downstream open raise
+        pass
+
+    return False
+
+
 def _get_filehandle(filepath_or, *args, **kwargs):
     """Open file if `filepath_or` looks like a string/unicode/bytes, else
     pass through.
     """
     if _is_string_or_bytes(filepath_or):
-        if h5py.is_hdf5(filepath_or):
+        if _is_hdf5(filepath_or):
+            # read-only by default, matching h5py 3.x, without leaning
+            # on the process-global default_file_mode switch
+            if not args and 'mode' not in kwargs:
+                args = ('r',)
+            # the h5py default chunk cache of 1 MiB is smaller than a
+            # single compressed qual chunk from a large demux file, which
+            # forces a decompress per access; a 64 MiB cache with a prime
+            # slot count keeps whole rows of chunks resident. Callers can
+            # still override any of these.
+            kwargs.setdefault('rdcc_nbytes', 64 * 1024 * 1024)
+            kwargs.setdefault('rdcc_nslots', 1000003)
+            kwargs.setdefault('rdcc_w0', 0.75)
             fh, own_fh = h5py.File(filepath_or, *args, **kwargs), True
         else:
             fh, own_fh = open(filepath_or, *args, **kwargs), True
@@ -8,9 +8,27 @@
 # The full license is in the file LICENSE, distributed with this software.
 # -----------------------------------------------------------------------------
 from setuptools import setup
+from setuptools.extension import Extension
 
 __version__ = "0.1.0-dev"
 
+# The Cython extensions speed up FASTQ parsing and demux serialization
+# but are strictly optional; the corresponding modules fall back to pure
+# Python implementations when the extensions are not built.
+try:
+    from Cython.Build import cythonize
+    import numpy as np
+except ImportError:
+    ext_modules = []
+else:
+    ext_modules = cythonize(
+        [Extension('qiita_files.parse._fastq_cy',
+                   ['qiita_files/parse/_fastq_cy.pyx'],
+                   include_dirs=[np.get_include()]),
+         Extension('qiita_files._demux_cy',
+                   ['qiita_files/_demux_cy.pyx'],
+                   include_dirs=[np.get_include()])])
+
 classes = """
     Development Status :: 3 - Alpha
     License :: OSI Approved :: BSD License
@@ -42,7 +60,9 @@ setup(name='qiita-files',
       packages=['qiita_files',
                 'qiita_files/format',
                 'qiita_files/parse'],
-      extras_require={'test': ["nose >= 0.10.1", "pep8"]},
+      ext_modules=ext_modules,
+      extras_require={'test': ["nose >= 0.10.1", "pep8"],
+                      'accel': ["numba"]},
       install_requires=['numpy', 'h5py', 'joblib'],
       classifiers=classifiers
       )